@@ -19,6 +19,9 @@ setup(
         "watson.migrations",
         "watson.templatetags",
     ],
+    extras_require={
+        "bulk-load": ["django-bulk-load"],
+    },
     package_data={
         "watson": [
             "locale/*/LC_MESSAGES/django.*",
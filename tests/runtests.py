@@ -15,6 +15,13 @@ AVAILABLE_DATABASES = {
 }
 
 
+def disable_synchronous_commit(connection, **kwargs):
+    # The test database is thrown away, so don't wait for commits to be flushed to disk.
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO OFF")
+
+
 def main():
     # Parse the command-line options.
     parser = OptionParser()
@@ -41,6 +48,14 @@ def main():
         default=False,
         help="Tells Django to stop running the test suite after first failed test.",
     )
+    parser.add_option(
+        "-p", "--parallel",
+        action="store",
+        dest="parallel",
+        default=os.environ.get("DJANGO_TEST_PROCESSES", "1"),
+        type="int",
+        help="Run the tests in this many parallel processes, each with its own test database.",
+    )
     parser.add_option(
         "-d", "--database",
         action="store",
@@ -126,6 +141,8 @@ def main():
         django.setup()
     except AttributeError:
         pass  # This is Django < 1.7
+    from django.db.backends.signals import connection_created
+    connection_created.connect(disable_synchronous_commit)
     # Configure the test runner.
     from django.test.utils import get_runner
     TestRunner = get_runner(settings)
@@ -133,6 +150,7 @@ def main():
         verbosity=int(options.verbosity),
         interactive=options.interactive,
         failfast=options.failfast,
+        parallel=options.parallel,
     )
     # Run the tests.
     failures = test_runner.run_tests(["test_watson"])
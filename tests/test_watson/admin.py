@@ -11,4 +11,6 @@ class WatsonTestModel1Admin(SearchAdmin):
     list_display = ("title",)
 
 
-admin.site.register(WatsonTestModel1, WatsonTestModel1Admin)
+# Guard against the module being imported more than once by a test collector.
+if not admin.site.is_registered(WatsonTestModel1):
+    admin.site.register(WatsonTestModel1, WatsonTestModel1Admin)
@@ -32,13 +32,8 @@ class WatsonTestModel1(TestModelBase):
     pass
 
 
-str_pk_gen = 0
-
-
 def get_str_pk():
-    global str_pk_gen
-    str_pk_gen += 1
-    return str(str_pk_gen)
+    return uuid.uuid4().hex
 
 
 class WatsonTestModel2(TestModelBase):
@@ -56,3 +51,10 @@ class WatsonTestModel3(TestModelBase):
         primary_key=True,
         default=uuid.uuid4,
     )
+
+
+class WatsonTestModel4(TestModelBase):
+
+    related = models.ManyToManyField(
+        WatsonTestModel1,
+    )
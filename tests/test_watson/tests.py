@@ -11,14 +11,14 @@ from __future__ import unicode_literals
 
 import json
 import string
-
-try:
-    from unittest import skipUnless
-except ImportError:
-    from django.utils.unittest import skipUnless
+from contextlib import contextmanager
+from functools import wraps
+from unittest import mock, skipUnless
 
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.conf import settings
 from django.contrib.auth.models import User
 from django import template
@@ -27,12 +27,31 @@ from django.db.models import Case, When, Value, IntegerField
 from django.db import connection
 
 from watson import search as watson
+from watson.management.commands import buildwatson
 from watson.models import SearchEntry
+from watson.templatetags import watson as watson_tags
+from watson.views import SearchView
 
-from test_watson.models import WatsonTestModel1, WatsonTestModel2, WatsonTestModel3
+from test_watson.models import WatsonTestModel1, WatsonTestModel2, WatsonTestModel3, WatsonTestModel4
 from test_watson import admin  # Force early registration of all admin models. # noQA
 
 
+# The models registered before the tests run, with their adapters.
+original_registrations = [(model, watson.get_adapter(model)) for model in watson.get_registered_models()]
+
+
+def setUpModule():
+    # Remove all the current registered models.
+    for model, _ in original_registrations:
+        watson.unregister(model)
+
+
+def tearDownModule():
+    # Re-register the old registered models.
+    for model, adapter in original_registrations:
+        watson.register(model, adapter.__class__)
+
+
 class RegistrationTest(TestCase):
     def testRegistration(self):
         # Register the model and test.
@@ -51,16 +70,24 @@ class RegistrationTest(TestCase):
 
 complex_registration_search_engine = watson.SearchEngine("restricted")
 
+search_backend = watson.get_backend()
+
+
+# Parse JSON responses with orjson, if available.
+if watson.orjson is not None:
+    json_loads = watson.orjson.loads
+else:
+    json_loads = json.loads
+
 
 class InstallUninstallTestBase(TestCase):
 
-    @skipUnless(watson.get_backend().requires_installation, "search backend does not require installation")
+    @skipUnless(search_backend.requires_installation, "search backend does not require installation")
     def testUninstallAndInstall(self):
-        backend = watson.get_backend()
         call_command("uninstallwatson", verbosity=0)
-        self.assertFalse(backend.is_installed())
+        self.assertFalse(search_backend.is_installed())
         call_command("installwatson", verbosity=0)
-        self.assertTrue(backend.is_installed())
+        self.assertTrue(search_backend.is_installed())
 
 
 class SearchTestBase(TestCase):
@@ -71,75 +98,76 @@ class SearchTestBase(TestCase):
 
     model3 = WatsonTestModel3
 
-    def setUp(self):
-        # If migrations are off, then this is needed to get the indices installed. It has to
-        # be called in the setUp() method, but multiple invocations should be safe.
-        call_command("installwatson", verbosity=0)
-        # Remove all the current registered models.
-        self.registered_models = watson.get_registered_models()
-        for model in self.registered_models:
-            watson.unregister(model)
+    watson_installed = False
+
+    @classmethod
+    def setUpClass(cls):
+        # If migrations are off, then this is needed to get the indices installed. It only has
+        # to be called once, outside of any test transaction.
+        if not SearchTestBase.watson_installed:
+            call_command("installwatson", verbosity=0)
+            SearchTestBase.watson_installed = True
         # Register the test models.
-        watson.register(self.model1)
-        watson.register(self.model2, exclude=("id",))
-        watson.register(self.model3, exclude=("id",))
+        watson.register(cls.model1)
+        watson.register(cls.model2, exclude=("id",))
+        watson.register(cls.model3, exclude=("id",))
         complex_registration_search_engine.register(
             WatsonTestModel1, exclude=("content", "description",), store=("is_published",)
         )
         complex_registration_search_engine.register(
             WatsonTestModel2, fields=("title",)
         )
-        # Create some test models.
-        self.test11 = WatsonTestModel1.objects.create(
-            title="title model1 instance11",
-            content="content model1 instance11",
-            description="description model1 instance11",
-        )
-        self.test12 = WatsonTestModel1.objects.create(
-            title="title model1 instance12",
-            content="content model1 instance12",
-            description="description model1 instance12",
-        )
-        self.test21 = WatsonTestModel2.objects.create(
-            title="title model2 instance21",
-            content="content model2 instance21",
-            description="description model2 instance21",
-        )
-        self.test22 = WatsonTestModel2.objects.create(
-            title="title model2 instance22",
-            content="content model2 instance22",
-            description="description model2 instance22",
-        )
-        self.test31 = WatsonTestModel3.objects.create(
-            title="title model3 instance31",
-            content="content model3 instance31",
-            description="description model3 instance31",
-        )
-        self.test32 = WatsonTestModel3.objects.create(
-            title="title model3 instance32",
-            content="content model3 instance32",
-            description="description model3 instance32",
-        )
+        super(SearchTestBase, cls).setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        # Create some test models. Bulk creation skips the save signals, so index them all in one go.
+        cls.test11, cls.test12 = cls.bulk_create(WatsonTestModel1, "model1", ("11", "12"))
+        cls.test21, cls.test22 = cls.bulk_create(WatsonTestModel2, "model2", ("21", "22"))
+        cls.test31, cls.test32 = cls.bulk_create(WatsonTestModel3, "model3", ("31", "32"))
+        call_command("buildwatson", verbosity=0)
 
-    def tearDown(self):
-        # Re-register the old registered models.
-        for model in self.registered_models:
-            watson.register(model)
+    def setUp(self):
+        super(SearchTestBase, self).setUp()
+        # MySQL keeps the search index in a MyISAM table, which isn't rolled back with the test
+        # transaction. Rebuild it for every test, so changes made by other tests don't leak in.
+        if connection.vendor == "mysql":
+            SearchEntry.objects.all().delete()
+            call_command("buildwatson", verbosity=0)
+
+    @classmethod
+    def bulk_create(cls, model, model_name, instance_names):
+        objs = model.objects.bulk_create([
+            model(
+                title="title {} instance{}".format(model_name, instance_name),
+                content="content {} instance{}".format(model_name, instance_name),
+                description="description {} instance{}".format(model_name, instance_name),
+            )
+            for instance_name in instance_names
+        ])
+        # Not all databases return the primary keys of bulk created objects.
+        if any(obj.pk is None for obj in objs):
+            objs = list(model.objects.order_by("-pk")[:len(objs)])[::-1]
+        return objs
+
+    def get_response_content(self, response):
+        # Decode the response once, so that it can be checked for many strings.
+        self.assertEqual(response.status_code, 200)
+        return force_str(response.content)
+
+    @classmethod
+    def tearDownClass(cls):
+        # The test models and search index are removed by rolling back the class transaction,
+        # except on MySQL, where the search index is not transactional.
+        if connection.vendor == "mysql":
+            SearchEntry.objects.all().delete()
+        super(SearchTestBase, cls).tearDownClass()
         # Unregister the test models.
-        watson.unregister(self.model1)
-        watson.unregister(self.model2)
-        watson.unregister(self.model3)
+        watson.unregister(cls.model1)
+        watson.unregister(cls.model2)
+        watson.unregister(cls.model3)
         complex_registration_search_engine.unregister(WatsonTestModel1)
         complex_registration_search_engine.unregister(WatsonTestModel2)
-        # Delete the test models.
-        WatsonTestModel1.objects.all().delete()
-        WatsonTestModel2.objects.all().delete()
-        del self.test11
-        del self.test12
-        del self.test21
-        del self.test22
-        # Delete the search index.
-        SearchEntry.objects.all().delete()
 
 
 class InternalsTest(SearchTestBase):
@@ -201,12 +229,115 @@ class InternalsTest(SearchTestBase):
         self.assertEqual(watson.search("fooo2").count(), 1)
         self.assertEqual(watson.search("fooo3").count(), 1)
 
+    def assertSearchIndexExists(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'watson_searchentry_search_tsv'")
+                self.assertTrue(cursor.fetchall())
+
+    def testBuildWatsonCommandDeferIndex(self):
+        WatsonTestModel1.objects.filter(id=self.test11.id).update(title="fooo1")
+        call_command("buildwatson", verbosity=0, defer_index=True)
+        self.assertEqual(watson.search("fooo1").count(), 1)
+        # The full text index is recreated once the rebuild is done.
+        self.assertSearchIndexExists()
+        # A failed rebuild is rolled back, along with the dropped index.
+        with mock.patch(
+            "watson.management.commands.buildwatson.rebuild_index_for_model",
+            side_effect=ValueError,
+        ):
+            self.assertRaises(ValueError, call_command, "buildwatson", verbosity=0, defer_index=True)
+        self.assertSearchIndexExists()
+        # The index can't be deferred for a non-atomic or partial rebuild.
+        for args, options in (((), {"non_atomic": True}), (("test_watson.WatsonTestModel1",), {})):
+            with self.subTest(args=args, options=options):
+                with self.assertRaises(CommandError):
+                    call_command("buildwatson", *args, verbosity=0, defer_index=True, **options)
+
+    def testBuildWatsonCommandQueriesPerBatch(self):
+        def count_build_queries():
+            with CaptureQueriesContext(connection) as queries:
+                call_command("buildwatson", "test_watson.WatsonTestModel1", verbosity=0)
+            return len(queries)
+        query_count = count_build_queries()
+        # Index some more objects, which should fit in the same batch.
+        WatsonTestModel1.objects.bulk_create([
+            WatsonTestModel1(title="title model1 instance1{}".format(n))
+            for n in range(3, 10)
+        ])
+        call_command("buildwatson", "test_watson.WatsonTestModel1", verbosity=0)
+        self.assertEqual(watson.filter(WatsonTestModel1, "TITLE").count(), 9)
+        # Rebuilding the index shouldn't take more queries for more objects.
+        self.assertEqual(count_build_queries(), query_count)
+
+    def testBuildWatsonCommandRewritesUnchangedEntries(self):
+        # The search entries are updated batch_size at a time.
+        for batch_size, update_count in ((1, 2), (100, 1)):
+            with self.subTest(batch_size=batch_size):
+                with CaptureQueriesContext(connection) as queries:
+                    call_command("buildwatson", "test_watson.WatsonTestModel1", verbosity=0, batch_size=batch_size)
+                self.assertEqual(len([
+                    query for query in queries
+                    if query["sql"].startswith("UPDATE") and SearchEntry._meta.db_table in query["sql"]
+                ]), update_count)
+
+    def testBuildWatsonObjectBatches(self):
+        for obj_list, objs in (
+            (WatsonTestModel1.objects.all(), [self.test11, self.test12]),
+            # Sliced querysets can't be paged by primary key, so they are read in their own order.
+            (WatsonTestModel1.objects.order_by("-pk")[:2], [self.test12, self.test11]),
+        ):
+            with self.subTest(query=str(obj_list.query)):
+                self.assertEqual(list(buildwatson.iter_obj_batches(obj_list, 1)), [[obj] for obj in objs])
+
+    def testBuildWatsonCommandInBatches(self):
+        # Create more objects than fit in a batch, without indexing them.
+        for model in (WatsonTestModel1, WatsonTestModel2, WatsonTestModel3):
+            model.objects.bulk_create([
+                model(title="fooo instance{}".format(n))
+                for n in range(5)
+            ])
+        self.assertEqual(watson.search("fooo").count(), 0)
+        call_command("buildwatson", verbosity=0, batch_size=2)
+        # Every object should be indexed exactly once.
+        self.assertEqual(watson.search("fooo").count(), 15)
+        self.assertEqual(SearchEntry.objects.filter(engine_slug="default").count(), 21)
+
+    def testBulkSaveSearchEntriesWithBulkLoad(self):
+        search_entries = [SearchEntry(), SearchEntry()]
+        # django-bulk-load is only used on PostgreSQL, and only when enabled.
+        for use_bulk_load, vendor, uses_bulk_load in (
+            (True, "postgresql", True),
+            (True, "sqlite", False),
+            (True, "mysql", False),
+            (False, "postgresql", False),
+        ):
+            with self.subTest(use_bulk_load=use_bulk_load, vendor=vendor), \
+                    self.settings(WATSON_USE_BULK_LOAD=use_bulk_load), \
+                    mock.patch.object(connection, "vendor", vendor), \
+                    mock.patch.object(watson, "bulk_insert_models") as bulk_insert_models, \
+                    mock.patch.object(SearchEntry.objects, "bulk_create") as bulk_create:
+                watson._bulk_save_search_entries(search_entries)
+                if uses_bulk_load:
+                    bulk_insert_models.assert_called_once_with(search_entries)
+                    bulk_create.assert_not_called()
+                else:
+                    bulk_create.assert_called_once_with(search_entries)
+                    bulk_insert_models.assert_not_called()
+
+    def testSerializeMeta(self):
+        adapter = watson.get_adapter(WatsonTestModel1)
+        # Only an empty dict skips the encoder, other empty values are still encoded.
+        for meta_obj, meta_encoded in (({}, "{}"), (None, "null"), ([], "[]"), (0, "0")):
+            with self.subTest(meta_obj=meta_obj), mock.patch.object(adapter, "get_meta", return_value=meta_obj):
+                self.assertEqual(adapter.serialize_meta(self.test11), meta_encoded)
+
     def testUpdateSearchIndex(self):
         # Update a model and make sure that the search results match.
         self.test11.title = "fooo"
         self.test11.save()
         # Test a search that should get one model.
-        exact_search = watson.search("fooo")
+        exact_search = list(watson.search("fooo")[:2])
         self.assertEqual(len(exact_search), 1)
         self.assertEqual(exact_search[0].title, "fooo")
         # Delete a model and make sure that the search results match.
@@ -220,6 +351,36 @@ class InternalsTest(SearchTestBase):
             self.assertEqual(watson.search("fooo").count(), 0)
         self.assertEqual(watson.search("fooo").count(), 1)
 
+    def testSearchIndexUpdateDeferredByContextForManyObjects(self):
+        with watson.update_index():
+            for obj in (self.test11, self.test12, self.test21, self.test31):
+                obj.title = "fooo"
+                obj.save()
+            WatsonTestModel2.objects.create(title="fooo")
+            self.assertEqual(watson.search("fooo").count(), 0)
+        self.assertEqual(watson.search("fooo").count(), 5)
+        self.assertEqual(SearchEntry.objects.filter(engine_slug="default").count(), 7)
+
+    def testSearchIndexUpdateDeferredByContextUsesLatestObject(self):
+        with watson.update_index():
+            obj = WatsonTestModel1.objects.get(id=self.test11.id)
+            obj.title = "baar"
+            obj.save()
+            obj = WatsonTestModel1.objects.get(id=self.test11.id)
+            obj.title = "fooo"
+            obj.save()
+        self.assertEqual(watson.search("baar").count(), 0)
+        self.assertEqual(watson.search("fooo").count(), 1)
+
+    def testSearchIndexUpdateDeferredByContextSkipsUnchangedEntries(self):
+        with CaptureQueriesContext(connection) as queries:
+            with watson.update_index():
+                self.test11.save()
+        self.assertFalse([
+            query for query in queries
+            if query["sql"].startswith("UPDATE") and SearchEntry._meta.db_table in query["sql"]
+        ])
+
     def testSearchIndexUpdateAbandonedOnError(self):
         try:
             with watson.update_index():
@@ -262,10 +423,17 @@ class InternalsTest(SearchTestBase):
 
     def testFixesDuplicateSearchEntries(self):
         search_entries = SearchEntry.objects.filter(engine_slug="default")
-        # Duplicate a couple of search entries.
-        for search_entry in search_entries.all()[:2]:
-            search_entry.id = None
-            search_entry.save()
+        # Duplicate a couple of search entries, copying the rows within the database.
+        fields = [field for field in SearchEntry._meta.concrete_fields if not field.primary_key]
+        select_sql, select_params = search_entries.values_list(
+            *(field.attname for field in fields)
+        )[:2].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO ' + connection.ops.quote_name(SearchEntry._meta.db_table) + ' (' +
+                ', '.join(connection.ops.quote_name(field.column) for field in fields) + ') ' + select_sql,
+                select_params
+            )
         # Make sure that we have eight (including duplicates).
         self.assertEqual(search_entries.all().count(), 8)
         # Run the rebuild command.
@@ -273,6 +441,36 @@ class InternalsTest(SearchTestBase):
         # Make sure that we have six again (including duplicates).
         self.assertEqual(search_entries.all().count(), 6)
 
+    def testRelatedFieldContent(self):
+        obj = WatsonTestModel4.objects.create(title="title model4 instance41")
+        obj.related.add(self.test11, self.test12)
+        adapter = watson.SearchAdapter(WatsonTestModel4)
+        adapter.fields = ("related__title",)
+        # Plain related columns are fetched in a single query.
+        with self.assertNumQueries(1):
+            content = adapter.get_content(obj)
+        self.assertEqual(sorted(content.split(" ")), sorted(
+            "title model1 instance11 title model1 instance12".split(" ")
+        ))
+        # Prefetched related objects are used as they are.
+        obj = WatsonTestModel4.objects.prefetch_related("related").get(id=obj.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(adapter.get_content(obj).split(" ")), sorted(content.split(" ")))
+
+        # Fields with a custom descriptor are read through the descriptor.
+        class UpperCaseDescriptor(object):
+            def __get__(self, instance, owner):
+                if instance is None:
+                    return self
+                return instance.__dict__["title"].upper()
+
+            def __set__(self, instance, value):
+                instance.__dict__["title"] = value
+
+        with mock.patch.object(WatsonTestModel1, "title", UpperCaseDescriptor()):
+            obj = WatsonTestModel4.objects.get(id=obj.id)
+            self.assertEqual(sorted(adapter.get_content(obj).split(" ")), sorted(content.upper().split(" ")))
+
     def testEmptyFilterGivesAllResults(self):
         for model in (WatsonTestModel1, WatsonTestModel2, WatsonTestModel3):
             self.assertEqual(watson.filter(model, "").count(), 2)
@@ -291,13 +489,39 @@ class InternalsTest(SearchTestBase):
         self.assertTrue(isinstance(obj, WatsonTestModel1))
         self.assertEqual(obj.title, "title model1 instance12")
 
-    @skipUnless(watson.get_backend().supports_prefix_matching, "Search backend does not support prefix matching.")
+    @skipUnless(search_backend.supports_prefix_matching, "Search backend does not support prefix matching.")
     def testPrefixFilter(self):
         self.assertEqual(watson.filter(WatsonTestModel1, "INSTAN").count(), 2)
 
 
+def with_live_filters(func):
+    """Runs a search test against the plain model registrations, then against live filtered ones."""
+    @wraps(func)
+    def do_with_live_filters(self):
+        func(self)
+        with self.subTest(live_filters=True), self.live_filter_registrations():
+            func(self)
+    return do_with_live_filters
+
+
 class SearchTest(SearchTestBase):
 
+    @contextmanager
+    def live_filter_registrations(self):
+        # Swap in registrations that only search published objects.
+        watson.unregister(WatsonTestModel1)
+        watson.unregister(WatsonTestModel2)
+        watson.register(WatsonTestModel1.objects.filter(is_published=True))
+        watson.register(WatsonTestModel2.objects.filter(is_published=True), exclude=("id",))
+        try:
+            yield
+        finally:
+            watson.unregister(WatsonTestModel1)
+            watson.unregister(WatsonTestModel2)
+            watson.register(self.model1)
+            watson.register(self.model2, exclude=("id",))
+
+    @with_live_filters
     def testEscaping(self):
         # This must not crash the database with a syntax error.
         list(watson.search(string.printable))
@@ -306,39 +530,47 @@ class SearchTest(SearchTestBase):
         self.assertEqual(watson.search("").count(), 0)
         self.assertEqual(watson.search(" ").count(), 0)
 
+    @with_live_filters
     def testMultiTableSearch(self):
-        # Test a search that should get all models.
-        self.assertEqual(watson.search("TITLE").count(), 6)
-        self.assertEqual(watson.search("CONTENT").count(), 6)
-        self.assertEqual(watson.search("DESCRIPTION").count(), 6)
-        self.assertEqual(watson.search("TITLE CONTENT DESCRIPTION").count(), 6)
-        # Test a search that should get two models.
-        self.assertEqual(watson.search("MODEL1").count(), 2)
-        self.assertEqual(watson.search("MODEL2").count(), 2)
-        self.assertEqual(watson.search("MODEL3").count(), 2)
-        self.assertEqual(watson.search("TITLE MODEL1").count(), 2)
-        self.assertEqual(watson.search("TITLE MODEL2").count(), 2)
-        self.assertEqual(watson.search("TITLE MODEL3").count(), 2)
-        # Test a search that should get one model.
-        self.assertEqual(watson.search("INSTANCE11").count(), 1)
-        self.assertEqual(watson.search("INSTANCE21").count(), 1)
-        self.assertEqual(watson.search("INSTANCE31").count(), 1)
-        self.assertEqual(watson.search("TITLE INSTANCE11").count(), 1)
-        self.assertEqual(watson.search("TITLE INSTANCE21").count(), 1)
-        self.assertEqual(watson.search("TITLE INSTANCE31").count(), 1)
-        # Test a search that should get zero models.
-        self.assertEqual(watson.search("FOOO").count(), 0)
-        self.assertEqual(watson.search("FOOO INSTANCE11").count(), 0)
-        self.assertEqual(watson.search("MODEL2 INSTANCE11").count(), 0)
-
+        for search_text, count in (
+            # Test a search that should get all models.
+            ("TITLE", 6),
+            ("CONTENT", 6),
+            ("DESCRIPTION", 6),
+            ("TITLE CONTENT DESCRIPTION", 6),
+            # Test a search that should get two models.
+            ("MODEL1", 2),
+            ("MODEL2", 2),
+            ("MODEL3", 2),
+            ("TITLE MODEL1", 2),
+            ("TITLE MODEL2", 2),
+            ("TITLE MODEL3", 2),
+            # Test a search that should get one model.
+            ("INSTANCE11", 1),
+            ("INSTANCE21", 1),
+            ("INSTANCE31", 1),
+            ("TITLE INSTANCE11", 1),
+            ("TITLE INSTANCE21", 1),
+            ("TITLE INSTANCE31", 1),
+            # Test a search that should get zero models.
+            ("FOOO", 0),
+            ("FOOO INSTANCE11", 0),
+            ("MODEL2 INSTANCE11", 0),
+        ):
+            with self.subTest(search_text=search_text), self.assertNumQueries(1):
+                self.assertEqual(watson.search(search_text).count(), count)
+
+    @with_live_filters
     def testSearchWithAccent(self):
-        WatsonTestModel1.objects.create(
+        x = WatsonTestModel1.objects.create(
             title="title model1 instance12",
             content="content model1 instance13 café",
             description="description model1 instance13",
         )
         self.assertEqual(watson.search("café").count(), 1)
+        x.delete()
 
+    @with_live_filters
     def testSearchWithSpecialChars(self):
         WatsonTestModel1.objects.all().delete()
 
@@ -392,142 +624,128 @@ class SearchTest(SearchTestBase):
         x.delete()
 
     @skipUnless(
-        watson.get_backend().supports_prefix_matching,
+        search_backend.supports_prefix_matching,
         "Search backend does not support prefix matching."
     )
+    @with_live_filters
     def testMultiTablePrefixSearch(self):
         self.assertEqual(watson.search("DESCR").count(), 6)
 
+    @with_live_filters
     def testLimitedModelList(self):
-        # Test a search that should get all models.
-        self.assertEqual(watson.search("TITLE", models=(WatsonTestModel1, WatsonTestModel2)).count(), 4)
-        # Test a search that should get two models.
-        self.assertEqual(watson.search("MODEL1", models=(WatsonTestModel1, WatsonTestModel2)).count(), 2)
-        self.assertEqual(watson.search("MODEL1", models=(WatsonTestModel1,)).count(), 2)
-        self.assertEqual(watson.search("MODEL2", models=(WatsonTestModel1, WatsonTestModel2)).count(), 2)
-        self.assertEqual(watson.search("MODEL2", models=(WatsonTestModel2,)).count(), 2)
-        self.assertEqual(watson.search("MODEL3", models=(WatsonTestModel2, WatsonTestModel3)).count(), 2)
-        self.assertEqual(watson.search("MODEL3", models=(WatsonTestModel3,)).count(), 2)
-        # Test a search that should get one model.
-        self.assertEqual(watson.search("INSTANCE11", models=(WatsonTestModel1, WatsonTestModel2)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE11", models=(WatsonTestModel1,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", models=(WatsonTestModel1, WatsonTestModel2,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", models=(WatsonTestModel2,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE31", models=(WatsonTestModel2, WatsonTestModel3,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE31", models=(WatsonTestModel3,)).count(), 1)
-        # Test a search that should get zero models.
-        self.assertEqual(watson.search("MODEL1", models=(WatsonTestModel2,)).count(), 0)
-        self.assertEqual(watson.search("MODEL2", models=(WatsonTestModel1,)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE21", models=(WatsonTestModel1,)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE11", models=(WatsonTestModel2,)).count(), 0)
-
+        for search_text, models, count in (
+            # Test a search that should get all models.
+            ("TITLE", (WatsonTestModel1, WatsonTestModel2), 4),
+            # Test a search that should get two models.
+            ("MODEL1", (WatsonTestModel1, WatsonTestModel2), 2),
+            ("MODEL1", (WatsonTestModel1,), 2),
+            ("MODEL2", (WatsonTestModel1, WatsonTestModel2), 2),
+            ("MODEL2", (WatsonTestModel2,), 2),
+            ("MODEL3", (WatsonTestModel2, WatsonTestModel3), 2),
+            ("MODEL3", (WatsonTestModel3,), 2),
+            # Test a search that should get one model.
+            ("INSTANCE11", (WatsonTestModel1, WatsonTestModel2), 1),
+            ("INSTANCE11", (WatsonTestModel1,), 1),
+            ("INSTANCE21", (WatsonTestModel1, WatsonTestModel2), 1),
+            ("INSTANCE21", (WatsonTestModel2,), 1),
+            ("INSTANCE31", (WatsonTestModel2, WatsonTestModel3), 1),
+            ("INSTANCE31", (WatsonTestModel3,), 1),
+            # Test a search that should get zero models.
+            ("MODEL1", (WatsonTestModel2,), 0),
+            ("MODEL2", (WatsonTestModel1,), 0),
+            ("INSTANCE21", (WatsonTestModel1,), 0),
+            ("INSTANCE11", (WatsonTestModel2,), 0),
+        ):
+            with self.subTest(search_text=search_text, models=models):
+                self.assertEqual(watson.search(search_text, models=models).count(), count)
+
+    @with_live_filters
     def testExcludedModelList(self):
-        # Test a search that should get all models.
-        self.assertEqual(watson.search("TITLE", exclude=()).count(), 6)
-        # Test a search that should get two models.
-        self.assertEqual(watson.search("MODEL1", exclude=()).count(), 2)
-        self.assertEqual(watson.search("MODEL1", exclude=(WatsonTestModel2,)).count(), 2)
-        self.assertEqual(watson.search("MODEL2", exclude=()).count(), 2)
-        self.assertEqual(watson.search("MODEL2", exclude=(WatsonTestModel1,)).count(), 2)
-        self.assertEqual(watson.search("MODEL3", exclude=()).count(), 2)
-        self.assertEqual(watson.search("MODEL3", exclude=(WatsonTestModel1,)).count(), 2)
-        # Test a search that should get one model.
-        self.assertEqual(watson.search("INSTANCE11", exclude=()).count(), 1)
-        self.assertEqual(watson.search("INSTANCE11", exclude=(WatsonTestModel2,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", exclude=()).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", exclude=(WatsonTestModel1,)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE31", exclude=()).count(), 1)
-        self.assertEqual(watson.search("INSTANCE31", exclude=(WatsonTestModel1,)).count(), 1)
-        # Test a search that should get zero models.
-        self.assertEqual(watson.search("MODEL1", exclude=(WatsonTestModel1,)).count(), 0)
-        self.assertEqual(watson.search("MODEL2", exclude=(WatsonTestModel2,)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE21", exclude=(WatsonTestModel2,)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE11", exclude=(WatsonTestModel1,)).count(), 0)
-
+        for search_text, exclude, count in (
+            # Test a search that should get all models.
+            ("TITLE", (), 6),
+            # Test a search that should get two models.
+            ("MODEL1", (), 2),
+            ("MODEL1", (WatsonTestModel2,), 2),
+            ("MODEL2", (), 2),
+            ("MODEL2", (WatsonTestModel1,), 2),
+            ("MODEL3", (), 2),
+            ("MODEL3", (WatsonTestModel1,), 2),
+            # Test a search that should get one model.
+            ("INSTANCE11", (), 1),
+            ("INSTANCE11", (WatsonTestModel2,), 1),
+            ("INSTANCE21", (), 1),
+            ("INSTANCE21", (WatsonTestModel1,), 1),
+            ("INSTANCE31", (), 1),
+            ("INSTANCE31", (WatsonTestModel1,), 1),
+            # Test a search that should get zero models.
+            ("MODEL1", (WatsonTestModel1,), 0),
+            ("MODEL2", (WatsonTestModel2,), 0),
+            ("INSTANCE21", (WatsonTestModel2,), 0),
+            ("INSTANCE11", (WatsonTestModel1,), 0),
+        ):
+            with self.subTest(search_text=search_text, exclude=exclude):
+                self.assertEqual(watson.search(search_text, exclude=exclude).count(), count)
+
+    @with_live_filters
     def testLimitedModelQuerySet(self):
-        # Test a search that should get all models.
-        self.assertEqual(watson.search(
-            "TITLE",
-            models=(
+        for search_text, models, count in (
+            # Test a search that should get all models.
+            ("TITLE", (
                 WatsonTestModel1.objects.filter(title__icontains="TITLE"),
                 WatsonTestModel2.objects.filter(title__icontains="TITLE"),
-            )
-        ).count(), 4)
-        # Test a search that should get two models.
-        self.assertEqual(
-            watson.search(
-                "MODEL1",
-                models=(WatsonTestModel1.objects.filter(
-                    title__icontains="MODEL1",
-                    description__icontains="MODEL1",
-                ),)
-            ).count(), 2)
-        self.assertEqual(watson.search("MODEL2", models=(WatsonTestModel2.objects.filter(
-            title__icontains="MODEL2",
-            description__icontains="MODEL2",
-        ),)).count(), 2)
-        self.assertEqual(watson.search("MODEL3", models=(WatsonTestModel3.objects.filter(
-            title__icontains="MODEL3",
-            description__icontains="MODEL3",
-        ),)).count(), 2)
-        # Test a search that should get one model.
-        self.assertEqual(watson.search("INSTANCE11", models=(WatsonTestModel1.objects.filter(
-            title__icontains="MODEL1",
-        ),)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", models=(WatsonTestModel2.objects.filter(
-            title__icontains="MODEL2",
-        ),)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE31", models=(WatsonTestModel3.objects.filter(
-            title__icontains="MODEL3",
-        ),)).count(), 1)
-        # Test a search that should get no models.
-        self.assertEqual(watson.search("INSTANCE11", models=(WatsonTestModel1.objects.filter(
-            title__icontains="MODEL2",
-        ),)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE21", models=(WatsonTestModel2.objects.filter(
-            title__icontains="MODEL1",
-        ),)).count(), 0)
-
+            ), 4),
+            # Test a search that should get two models.
+            ("MODEL1", (
+                WatsonTestModel1.objects.filter(title__icontains="MODEL1", description__icontains="MODEL1"),
+            ), 2),
+            ("MODEL2", (
+                WatsonTestModel2.objects.filter(title__icontains="MODEL2", description__icontains="MODEL2"),
+            ), 2),
+            ("MODEL3", (
+                WatsonTestModel3.objects.filter(title__icontains="MODEL3", description__icontains="MODEL3"),
+            ), 2),
+            # Test a search that should get one model.
+            ("INSTANCE11", (WatsonTestModel1.objects.filter(title__icontains="MODEL1"),), 1),
+            ("INSTANCE21", (WatsonTestModel2.objects.filter(title__icontains="MODEL2"),), 1),
+            ("INSTANCE31", (WatsonTestModel3.objects.filter(title__icontains="MODEL3"),), 1),
+            # Test a search that should get no models.
+            ("INSTANCE11", (WatsonTestModel1.objects.filter(title__icontains="MODEL2"),), 0),
+            ("INSTANCE21", (WatsonTestModel2.objects.filter(title__icontains="MODEL1"),), 0),
+        ):
+            with self.subTest(search_text=search_text, models=models):
+                self.assertEqual(watson.search(search_text, models=models).count(), count)
+
+    @with_live_filters
     def testExcludedModelQuerySet(self):
-        # Test a search that should get all models.
-        self.assertEqual(
-            watson.search(
-                "TITLE",
-                exclude=(
-                    WatsonTestModel1.objects.filter(title__icontains="FOOO"),
-                    WatsonTestModel2.objects.filter(title__icontains="FOOO"),)
-            ).count(), 6)
-        # Test a search that should get two models.
-        self.assertEqual(watson.search("MODEL1", exclude=(WatsonTestModel1.objects.filter(
-            title__icontains="INSTANCE21",
-            description__icontains="INSTANCE22",
-        ),)).count(), 2)
-        self.assertEqual(watson.search("MODEL2", exclude=(WatsonTestModel2.objects.filter(
-            title__icontains="INSTANCE11",
-            description__icontains="INSTANCE12",
-        ),)).count(), 2)
-        self.assertEqual(watson.search("MODEL3", exclude=(WatsonTestModel3.objects.filter(
-            title__icontains="INSTANCE11",
-            description__icontains="INSTANCE12",
-        ),)).count(), 2)
-        # Test a search that should get one model.
-        self.assertEqual(watson.search("INSTANCE11", exclude=(WatsonTestModel1.objects.filter(
-            title__icontains="MODEL2",
-        ),)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", exclude=(WatsonTestModel2.objects.filter(
-            title__icontains="MODEL1",
-        ),)).count(), 1)
-        self.assertEqual(watson.search("INSTANCE21", exclude=(WatsonTestModel3.objects.filter(
-            title__icontains="MODEL1",
-        ),)).count(), 1)
-        # Test a search that should get no models.
-        self.assertEqual(watson.search("INSTANCE11", exclude=(WatsonTestModel1.objects.filter(
-            title__icontains="MODEL1",
-        ),)).count(), 0)
-        self.assertEqual(watson.search("INSTANCE21", exclude=(WatsonTestModel2.objects.filter(
-            title__icontains="MODEL2",
-        ),)).count(), 0)
-
+        for search_text, exclude, count in (
+            # Test a search that should get all models.
+            ("TITLE", (
+                WatsonTestModel1.objects.filter(title__icontains="FOOO"),
+                WatsonTestModel2.objects.filter(title__icontains="FOOO"),
+            ), 6),
+            # Test a search that should get two models.
+            ("MODEL1", (
+                WatsonTestModel1.objects.filter(title__icontains="INSTANCE21", description__icontains="INSTANCE22"),
+            ), 2),
+            ("MODEL2", (
+                WatsonTestModel2.objects.filter(title__icontains="INSTANCE11", description__icontains="INSTANCE12"),
+            ), 2),
+            ("MODEL3", (
+                WatsonTestModel3.objects.filter(title__icontains="INSTANCE11", description__icontains="INSTANCE12"),
+            ), 2),
+            # Test a search that should get one model.
+            ("INSTANCE11", (WatsonTestModel1.objects.filter(title__icontains="MODEL2"),), 1),
+            ("INSTANCE21", (WatsonTestModel2.objects.filter(title__icontains="MODEL1"),), 1),
+            ("INSTANCE21", (WatsonTestModel3.objects.filter(title__icontains="MODEL1"),), 1),
+            # Test a search that should get no models.
+            ("INSTANCE11", (WatsonTestModel1.objects.filter(title__icontains="MODEL1"),), 0),
+            ("INSTANCE21", (WatsonTestModel2.objects.filter(title__icontains="MODEL2"),), 0),
+        ):
+            with self.subTest(search_text=search_text, exclude=exclude):
+                self.assertEqual(watson.search(search_text, exclude=exclude).count(), count)
+
+    @with_live_filters
     def testKitchenSink(self):
         """For sanity, let's just test everything together in one giant search of doom!"""
         self.assertEqual(watson.search(
@@ -542,6 +760,7 @@ class SearchTest(SearchTestBase):
             )
         ).get().title, "title model1 instance11")
 
+    @with_live_filters
     def testReferencingWatsonRankInAnnotations(self):
         """We should be able to reference watson_rank from annotate expressions"""
         entries = watson.search("model1").annotate(
@@ -563,7 +782,7 @@ class SearchTest(SearchTestBase):
                 self.assertFalse(entry.relevant)
 
 
-class LiveFilterSearchTest(SearchTest):
+class LiveFilterSearchTest(SearchTestBase):
 
     model1 = WatsonTestModel1.objects.filter(is_published=True)
 
@@ -617,14 +836,14 @@ class RankingTest(SearchTestBase):
             lambda: watson.filter(WatsonTestModel1, "TITLE", ranking=False)[0].watson_rank
         )
 
-    @skipUnless(watson.get_backend().supports_ranking, "search backend does not support ranking")
+    @skipUnless(search_backend.supports_ranking, "search backend does not support ranking")
     def testRankingWithSearch(self):
         self.assertEqual(
             [entry.title for entry in watson.search("FOOO")],
             ["title model1 instance11 fooo baar fooo", "title model1 instance12"]
         )
 
-    @skipUnless(watson.get_backend().supports_ranking, "search backend does not support ranking")
+    @skipUnless(search_backend.supports_ranking, "search backend does not support ranking")
     def testRankingWithFilter(self):
         self.assertEqual(
             [entry.title for entry in watson.filter(WatsonTestModel1, "FOOO")],
@@ -637,6 +856,27 @@ class ComplexRegistrationTest(SearchTestBase):
     def testMetaStored(self):
         self.assertEqual(complex_registration_search_engine.search("instance11")[0].meta["is_published"], True)
 
+    @skipUnless(watson.orjson is not None, "orjson is not installed")
+    def testMetaStoredWithOrjson(self):
+        with self.settings(WATSON_USE_ORJSON=True):
+            self.test11.save()
+            self.assertEqual(complex_registration_search_engine.search("instance11")[0].meta["is_published"], True)
+
+    @skipUnless(watson.orjson is not None, "orjson is not installed")
+    def testEncodeJSONWithOrjson(self):
+        # Values that orjson encodes differently are encoded with the json module instead.
+        for obj in ({"a": 1}, {"a": float("nan")}, {"a": [float("inf")]}, {"a": 2 ** 70}):
+            with self.subTest(obj=obj), self.settings(WATSON_USE_ORJSON=True):
+                self.assertEqual(json.dumps(json.loads(watson.encode_json(obj))), json.dumps(obj))
+
+    @skipUnless(watson.orjson is not None, "orjson is not installed")
+    def testDecodeLegacyMetaWithOrjson(self):
+        adapter = watson.get_adapter(WatsonTestModel1)
+        # Meta encoded by the json module is still decoded.
+        for meta_encoded in ('{"a": 1}', '{"a": NaN}', '{"a": Infinity}', '{"a": %d}' % 2 ** 70):
+            with self.subTest(meta_encoded=meta_encoded), self.settings(WATSON_USE_ORJSON=True):
+                self.assertEqual(json.dumps(adapter.deserialize_meta(meta_encoded)), meta_encoded)
+
     def testMetaNotStored(self):
         self.assertRaises(
             KeyError,
@@ -657,17 +897,18 @@ class ComplexRegistrationTest(SearchTestBase):
         self.assertEqual(complex_registration_search_engine.filter(WatsonTestModel2, "DESCRIPTION").count(), 0)
 
 
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
 class AdminIntegrationTest(SearchTestBase):
 
-    def setUp(self):
-        super(AdminIntegrationTest, self).setUp()
-        self.user = User(
+    @classmethod
+    def setUpTestData(cls):
+        super(AdminIntegrationTest, cls).setUpTestData()
+        cls.user = User.objects.create_user(
             username="foo",
+            password="bar",
             is_staff=True,
             is_superuser=True,
         )
-        self.user.set_password("bar")
-        self.user.save()
 
     @skipUnless("django.contrib.admin" in settings.INSTALLED_APPS, "Django admin site not installed")
     def testAdminIntegration(self):
@@ -678,66 +919,106 @@ class AdminIntegrationTest(SearchTestBase):
         )
         # Test a search with no query.
         response = self.client.get("/admin/test_watson/watsontestmodel1/")
-        self.assertContains(response, "instance11")
-        self.assertContains(response, "instance12")
-        self.assertContains(response, "searchbar")  # Ensure that the search bar renders.
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertIn("instance12", content)
+        self.assertIn("searchbar", content)  # Ensure that the search bar renders.
         # Test a search for all the instances.
         response = self.client.get("/admin/test_watson/watsontestmodel1/?q=title content description")
-        self.assertContains(response, "instance11")
-        self.assertContains(response, "instance12")
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertIn("instance12", content)
         # Test a search for half the instances.
         response = self.client.get("/admin/test_watson/watsontestmodel1/?q=instance11")
-        self.assertContains(response, "instance11")
-        self.assertNotContains(response, "instance12")
-
-    def tearDown(self):
-        super(AdminIntegrationTest, self).tearDown()
-        self.user.delete()
-        del self.user
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertNotIn("instance12", content)
 
 
 class SiteSearchTest(SearchTestBase):
+
+    all_titles = {
+        "title model1 instance11",
+        "title model1 instance12",
+        "title model2 instance21",
+        "title model2 instance22",
+        "title model3 instance31",
+        "title model3 instance32",
+    }
+
     def testSiteSearch(self):
         # Test a search than should find everything.
         response = self.client.get("/simple/?q=title")
-        self.assertContains(response, "instance11")
-        self.assertContains(response, "instance12")
-        self.assertContains(response, "instance21")
-        self.assertContains(response, "instance22")
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertIn("instance12", content)
+        self.assertIn("instance21", content)
+        self.assertIn("instance22", content)
         self.assertTemplateUsed(response, "watson/search_results.html")
         # Test a search that should find one thing.
         response = self.client.get("/simple/?q=instance11")
-        self.assertContains(response, "instance11")
-        self.assertNotContains(response, "instance12")
-        self.assertNotContains(response, "instance21")
-        self.assertNotContains(response, "instance22")
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertNotIn("instance12", content)
+        self.assertNotIn("instance21", content)
+        self.assertNotIn("instance22", content)
         # Test a search that should find nothing.
         response = self.client.get("/simple/?q=fooo")
-        self.assertNotContains(response, "instance11")
-        self.assertNotContains(response, "instance12")
-        self.assertNotContains(response, "instance21")
-        self.assertNotContains(response, "instance22")
+        content = self.get_response_content(response)
+        self.assertNotIn("instance11", content)
+        self.assertNotIn("instance12", content)
+        self.assertNotIn("instance21", content)
+        self.assertNotIn("instance22", content)
+
+    def testSearchResultsTagPrefetchesObjects(self):
+        search_results = list(watson.search("title"))
+        template.Template("{% load watson %}{% search_results search_results %}").render(template.Context({
+            "search_results": search_results,
+            "query": "title",
+        }))
+        with self.assertNumQueries(0):
+            objs = set(search_result.object for search_result in search_results)
+        self.assertEqual(objs, {self.test11, self.test12, self.test21, self.test22, self.test31, self.test32})
+
+    def testSearchResultItemTemplatesNotCachedInDebug(self):
+        render = template.Template("{% load watson %}{% search_result_item result %}").render
+        # The selected templates are cached, unless DEBUG is on.
+        for debug, cached in ((True, False), (False, True)):
+            with self.subTest(debug=debug), self.settings(DEBUG=debug):
+                render(template.Context({"result": watson.search("instance11").get(), "query": "instance11"}))
+                self.assertEqual(bool(watson_tags._search_result_item_templates), cached)
+
+    def testSiteSearchPrefetchesObjects(self):
+        view = SearchView()
+        view.query = "title"
+        search_results = list(view.get_queryset())
+        with self.assertNumQueries(0):
+            objs = set(search_result.object for search_result in search_results)
+        self.assertEqual(objs, {self.test11, self.test12, self.test21, self.test22, self.test31, self.test32})
 
     def testSiteSearchJSON(self):
         # Test a search that should find everything.
         response = self.client.get("/simple/json/?q=title")
         self.assertEqual(response["Content-Type"], "application/json; charset=utf-8")
-        results = set(result["title"] for result in json.loads(force_str(response.content))["results"])
-        self.assertEqual(len(results), 6)
-        self.assertTrue("title model1 instance11" in results)
-        self.assertTrue("title model1 instance12" in results)
-        self.assertTrue("title model2 instance21" in results)
-        self.assertTrue("title model2 instance22" in results)
-        self.assertTrue("title model3 instance31" in results)
-        self.assertTrue("title model3 instance32" in results)
+        results = set(result["title"] for result in json_loads(response.content)["results"])
+        self.assertSetEqual(results, self.all_titles)
+
+    @skipUnless(watson.orjson is not None, "orjson is not installed")
+    def testSiteSearchJSONWithOrjson(self):
+        with self.settings(WATSON_USE_ORJSON=True):
+            response = self.client.get("/simple/json/?q=title")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        results = set(result["title"] for result in json_loads(response.content)["results"])
+        self.assertSetEqual(results, self.all_titles)
 
     def testSiteSearchCustom(self):
         # Test a search than should find everything.
         response = self.client.get("/custom/?fooo=title")
-        self.assertContains(response, "instance11")
-        self.assertContains(response, "instance12")
-        self.assertContains(response, "instance21")
-        self.assertContains(response, "instance22")
+        content = self.get_response_content(response)
+        self.assertIn("instance11", content)
+        self.assertIn("instance12", content)
+        self.assertIn("instance21", content)
+        self.assertIn("instance22", content)
         self.assertTemplateUsed(response, "watson/search_results.html")
         # Test that the extra context is included.
         self.assertEqual(response.context["foo"], "bar")
@@ -767,14 +1048,8 @@ class SiteSearchTest(SearchTestBase):
         # Test a search that should find everything.
         response = self.client.get("/custom/json/?fooo=title&page=last")
         self.assertEqual(response["Content-Type"], "application/json; charset=utf-8")
-        results = set(result["title"] for result in json.loads(force_str(response.content))["results"])
-        self.assertEqual(len(results), 6)
-        self.assertTrue("title model1 instance11" in results)
-        self.assertTrue("title model1 instance12" in results)
-        self.assertTrue("title model2 instance21" in results)
-        self.assertTrue("title model2 instance22" in results)
-        self.assertTrue("title model3 instance31" in results)
-        self.assertTrue("title model3 instance32" in results)
+        results = set(result["title"] for result in json_loads(response.content)["results"])
+        self.assertSetEqual(results, self.all_titles)
         # Test a search with an invalid page.
         response = self.client.get("/custom/json/?fooo=title&page=200")
         self.assertEqual(response.status_code, 404)
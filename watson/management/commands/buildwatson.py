@@ -2,6 +2,9 @@
 
 from __future__ import unicode_literals, print_function
 
+from contextlib import ExitStack
+from itertools import islice
+
 from django.core.management.base import BaseCommand, CommandError
 from django.apps import apps
 from django.contrib import admin
@@ -12,7 +15,7 @@ from django.utils.translation import activate
 from django.conf import settings
 
 
-from watson.search import SearchEngine, _bulk_save_search_entries
+from watson.search import SearchEngine, _bulk_save_search_entries, get_backend
 from watson.models import SearchEntry
 
 
@@ -29,6 +32,25 @@ def get_engine(engine_slug_):
         raise CommandError("Search Engine \"%s\" is not registered!" % force_str(engine_slug_))
 
 
+def iter_obj_batches(obj_list, batch_size):
+    """yields the objects in a queryset a batch at a time"""
+    # Sliced querysets can't be filtered or reordered, and DISTINCT ON needs its own ordering,
+    # so those are streamed in their own order.
+    if not obj_list.query.can_filter() or obj_list.query.distinct_fields:
+        obj_iter = obj_list.iterator()
+        obj_batch = list(islice(obj_iter, batch_size))
+        while obj_batch:
+            yield obj_batch
+            obj_batch = list(islice(obj_iter, batch_size))
+        return
+    # Read the objects in primary key order, so each batch starts where the last one ended.
+    obj_list = obj_list.order_by("pk")
+    obj_batch = list(obj_list[:batch_size])
+    while obj_batch:
+        yield obj_batch
+        obj_batch = list(obj_list.filter(pk__gt=obj_batch[-1].pk)[:batch_size])
+
+
 def rebuild_index_for_model(model_, engine_slug_, verbosity_, slim_=False, batch_size_=100, non_atomic_=False):
     """rebuilds index for a model"""
 
@@ -43,19 +65,24 @@ def rebuild_index_for_model(model_, engine_slug_, verbosity_, slim_=False, batch
         else:
             obj_list = model_._default_manager.all()
 
-        for obj in obj_list.iterator():
-            for search_entry in search_engine_._update_obj_index_iter(obj):
+        for obj_batch in iter_obj_batches(obj_list, batch_size_):
+            # Index the objects a batch at a time, so their existing search entries are fetched together.
+            # Every search entry is rewritten, so the database recomputes its full text data.
+            for search_entry in search_engine_._update_objs_index_iter(
+                model_, obj_batch, force=True, batch_size=batch_size_,
+            ):
                 yield search_entry
-            local_refreshed_model_count[0] += 1
-            if verbosity_ >= 3:
-                print(
-                    "Refreshed search entry for {model} {obj} "
-                    "in {engine_slug!r} search engine.".format(
-                        model=force_str(model_._meta.verbose_name),
-                        obj=force_str(obj),
-                        engine_slug=force_str(engine_slug_),
+            for obj in obj_batch:
+                local_refreshed_model_count[0] += 1
+                if verbosity_ >= 3:
+                    print(
+                        "Refreshed search entry for {model} {obj} "
+                        "in {engine_slug!r} search engine.".format(
+                            model=force_str(model_._meta.verbose_name),
+                            obj=force_str(obj),
+                            engine_slug=force_str(engine_slug_),
+                        )
                     )
-                )
         if verbosity_ == 2:
             print(
                 "Refreshed {local_refreshed_model_count} {model} search entry(s) "
@@ -102,12 +129,20 @@ class Command(BaseCommand):
             help="Commit index entries in batches. WARNING: if buildwatson fails, \
             the index will be incomplete."
         )
+        parser.add_argument(
+            '--defer-index',
+            action='store_true',
+            default=False,
+            help="Drop the full text index during a full rebuild, and recreate it afterwards. \
+            The whole rebuild runs in one transaction that locks the search index. WARNING: \
+            all searches, and all writes to indexed models, will block until buildwatson finishes."
+        )
         parser.add_argument(
             '--batch-size',
             action='store',
             default=100,
             type=int,
-            help="The batchsize with which entries will be added to the index."
+            help="The batchsize with which objects will be read, and entries added to the index."
         )
 
     def handle(self, *args, **options):
@@ -127,6 +162,7 @@ class Command(BaseCommand):
         slim = options.get("slim")
         batch_size = options.get("batch_size")
         non_atomic = options.get("non_atomic")
+        defer_index = options.get("defer_index")
 
         # work-around for legacy optparser hack in BaseCommand. In Django=1.10 the
         # args are collected in options['apps'], but in earlier versions they are
@@ -134,6 +170,12 @@ class Command(BaseCommand):
         if len(options['apps']):
             args = options['apps']
 
+        # The index can only be deferred around a single transaction that rebuilds every model.
+        if defer_index and non_atomic:
+            raise CommandError("--defer-index cannot be combined with --non-atomic!")
+        if defer_index and args:
+            raise CommandError("--defer-index can only be used when rebuilding all models!")
+
         # get the search engine we'll be checking registered models for, may be "default"
         search_engine = get_engine(engine_slug)
         models = []
@@ -179,38 +221,42 @@ class Command(BaseCommand):
             else:  # loop through all engines
                 engine_slugs = [x[0] for x in SearchEngine.get_created_engines()]
 
-            for engine_slug in engine_slugs:
-                search_engine = get_engine(engine_slug)
-                registered_models = search_engine.get_registered_models()
-                # Rebuild the index for all registered models.
-                for model in registered_models:
-                    refreshed_model_count += rebuild_index_for_model(
-                        model,
-                        engine_slug,
-                        verbosity,
-                        slim_=slim,
-                        batch_size_=batch_size,
-                        non_atomic_=non_atomic)
-
-                # Clean out any search entries that exist for stale content types.
-                # Only do it during full rebuild
-                valid_content_types = [ContentType.objects.get_for_model(model) for model in registered_models]
-                stale_entries = SearchEntry.objects.filter(
-                    engine_slug=engine_slug,
-                ).exclude(
-                    content_type__in=valid_content_types
-                )
-                stale_entry_count = stale_entries.count()
-                if stale_entry_count > 0:
-                    stale_entries.delete()
-                if verbosity >= 1:
-                    print(
-                        "Deleted {stale_entry_count} stale search entry(s) "
-                        "in {engine_slug!r} search engine.".format(
-                            stale_entry_count=stale_entry_count,
-                            engine_slug=force_str(engine_slug),
-                        )
+            with ExitStack() as stack:
+                # Defer maintenance of the search index until every engine has been rebuilt.
+                if defer_index:
+                    stack.enter_context(get_backend().deferred_index())
+                for engine_slug in engine_slugs:
+                    search_engine = get_engine(engine_slug)
+                    registered_models = search_engine.get_registered_models()
+                    # Rebuild the index for all registered models.
+                    for model in registered_models:
+                        refreshed_model_count += rebuild_index_for_model(
+                            model,
+                            engine_slug,
+                            verbosity,
+                            slim_=slim,
+                            batch_size_=batch_size,
+                            non_atomic_=non_atomic)
+
+                    # Clean out any search entries that exist for stale content types.
+                    # Only do it during full rebuild
+                    valid_content_types = [ContentType.objects.get_for_model(model) for model in registered_models]
+                    stale_entries = SearchEntry.objects.filter(
+                        engine_slug=engine_slug,
+                    ).exclude(
+                        content_type__in=valid_content_types
                     )
+                    stale_entry_count = stale_entries.count()
+                    if stale_entry_count > 0:
+                        stale_entries.delete()
+                    if verbosity >= 1:
+                        print(
+                            "Deleted {stale_entry_count} stale search entry(s) "
+                            "in {engine_slug!r} search engine.".format(
+                                stale_entry_count=stale_entry_count,
+                                engine_slug=force_str(engine_slug),
+                            )
+                        )
 
         if verbosity == 1:
             print(
@@ -2,8 +2,12 @@
 
 from __future__ import unicode_literals
 
+import hashlib
 import json
+import math
+import re
 import sys
+from collections import defaultdict
 from itertools import chain, islice
 from threading import local
 from functools import wraps
@@ -11,20 +15,57 @@ from weakref import WeakValueDictionary
 
 from django.conf import settings
 from django.core.signals import request_finished
-from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ObjectDoesNotExist
 from django.db import models, connections, router
 from django.db.models import Q
 from django.db.models.expressions import RawSQL
-from django.db.models.functions import Cast
+from django.db.models.functions import MD5, Cast
 from django.db.models.query import QuerySet
+from django.db.models.query_utils import DeferredAttribute
 from django.db.models.signals import post_save, pre_delete
 from django.utils.encoding import force_str
+from django.utils.functional import cached_property
 from django.utils.html import strip_tags
 from django.core.serializers.json import DjangoJSONEncoder
 try:
     from importlib import import_module
 except ImportError:
     from django.utils.importlib import import_module
+try:
+    import orjson
+except ImportError:  # orjson is an optional dependency.
+    orjson = None
+try:
+    from django_bulk_load import bulk_insert_models
+except ImportError:  # django-bulk-load is an optional dependency.
+    bulk_insert_models = None
+
+
+# Matches the start of anything the HTML parser used by strip_tags() would treat as markup.
+RE_HTML_TAG_OPEN = re.compile(r"<[a-zA-Z/!?]")
+
+# Matches any number too long to fit in 64 bits, along with a few that do.
+RE_JSON_LARGE_INT = re.compile(r"\d{20}")
+
+# The types of related object sets that are joined together when resolving fields.
+QUERYSET_TYPES = (QuerySet, models.Manager)
+
+
+def _is_column(model, name):
+    """
+    Checks whether the given name is a concrete, non-relational field on the given model.
+
+    Fields with a custom descriptor don't count, since reading them may not give the raw column value.
+    """
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return (
+        field.concrete and
+        not field.is_relation and
+        type(getattr(model, field.attname, None)) is DeferredAttribute
+    )
 
 
 class SearchAdapterError(Exception):
@@ -32,6 +73,54 @@ class SearchAdapterError(Exception):
     """Something went wrong with a search adapter."""
 
 
+# Used to encode the values that orjson cannot, in the same format as the json module.
+_json_encoder = DjangoJSONEncoder()
+
+
+def _use_orjson():
+    """Checks whether meta should be encoded with orjson, if it's installed."""
+    return orjson is not None and getattr(settings, "WATSON_USE_ORJSON", False)
+
+
+def _is_finite_json(value):
+    """Checks that the given JSON data has no NaN or infinite floats, which orjson would encode as null."""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, dict):
+        return all(_is_finite_json(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_is_finite_json(item) for item in value)
+    return True
+
+
+def encode_json(obj):
+    """
+    Encodes the given object as a JSON string, using orjson if it's enabled.
+
+    Values that orjson would encode differently to the json module, such as NaN or integers
+    beyond 64 bits, are encoded with the json module instead.
+    """
+    if _use_orjson() and _is_finite_json(obj):
+        try:
+            return orjson.dumps(
+                obj,
+                default=_json_encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            ).decode("utf-8")
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, cls=DjangoJSONEncoder)
+
+
+def _use_bulk_load(connection):
+    """Checks whether search entries should be loaded with django-bulk-load, if it's installed."""
+    return (
+        bulk_insert_models is not None and
+        getattr(settings, "WATSON_USE_BULK_LOAD", False) and
+        connection.vendor == "postgresql"
+    )
+
+
 class SearchAdapter(object):
 
     """An adapter for performing a full-text search on a model."""
@@ -51,8 +140,7 @@ class SearchAdapter(object):
 
     def _resolve_field(self, obj, name):
         """Resolves the content of the given model field."""
-        name_parts = name.split("__", 1)
-        prefix = name_parts[0]
+        prefix, _, suffix = name.partition("__")
         # If we're at the end of the resolve chain, return.
         if obj is None:
             return ""
@@ -74,31 +162,55 @@ class SearchAdapter(object):
                         search_adapter=self,
                     )
                 )
-            else:
-                # Run the attribute on the search adapter, if it's callable.
-                if not isinstance(value, (QuerySet, models.Manager)):
-                    if callable(value):
-                        value = value(obj)
+            is_queryset = isinstance(value, QUERYSET_TYPES)
+            # Run the attribute on the search adapter, if it's callable.
+            if not is_queryset and callable(value):
+                value = value(obj)
+                is_queryset = isinstance(value, QUERYSET_TYPES)
         else:
+            is_queryset = isinstance(value, QUERYSET_TYPES)
             # Run the attribute on the object, if it's callable.
-            if not isinstance(value, (QuerySet, models.Manager)):
-                if callable(value):
-                    value = value()
+            if not is_queryset and callable(value):
+                value = value()
+                is_queryset = isinstance(value, QUERYSET_TYPES)
         # Look up recursive fields.
-        if len(name_parts) == 2:
-            if isinstance(value, (QuerySet, models.Manager)):
-                return " ".join(force_str(self._resolve_field(obj, name_parts[1])) for obj in value.all())
-            return self._resolve_field(value, name_parts[1])
+        if suffix:
+            if is_queryset:
+                related_queryset = value.all()
+                # Fetch plain columns straight from the database, rather than instantiating each related object.
+                if related_queryset._result_cache is None and _is_column(related_queryset.model, suffix):
+                    return " ".join([force_str(related) for related in related_queryset.values_list(suffix, flat=True)])
+                return " ".join([force_str(self._resolve_field(related, suffix)) for related in related_queryset])
+            return self._resolve_field(value, suffix)
         # Resolve querysets.
-        if isinstance(value, (QuerySet, models.Manager)):
-            value = " ".join(force_str(related) for related in value.all())
+        if is_queryset:
+            value = " ".join([force_str(related) for related in value.all()])
         # Resolution complete!
         return value
 
+    @cached_property
+    def _content_field_names(self):
+        """The names of the fields that make up the search content, computed once per adapter."""
+        # Get the field names to look up.
+        field_names = self.fields or (
+            field.name for field in self.model._meta.fields if
+            isinstance(field, (models.CharField, models.TextField))
+        )
+        # Exclude named fields.
+        return tuple(field_name for field_name in field_names if field_name not in self.exclude)
+
+    @cached_property
+    def _has_int_pk(self):
+        """Whether the model is indexed by its integer primary key, computed once per adapter."""
+        from watson.models import has_int_pk
+        return has_int_pk(self.model)
+
     def prepare_content(self, content):
         """Sanitizes the given content string for better parsing by the search engine."""
-        # Strip out HTML tags.
-        content = strip_tags(content)
+        # Strip out HTML tags. The HTML parser is slow, so skip it for plain text.
+        content = force_str(content)
+        if RE_HTML_TAG_OPEN.search(content):
+            content = strip_tags(content)
         return content
 
     def get_title(self, obj):
@@ -136,18 +248,11 @@ class SearchAdapter(object):
 
         The default implementation returns all the registered fields in your model joined together.
         """
-        # Get the field names to look up.
-        field_names = self.fields or (
-            field.name for field in self.model._meta.fields if
-            isinstance(field, (models.CharField, models.TextField))
-        )
-        # Exclude named fields.
-        field_names = (field_name for field_name in field_names if field_name not in self.exclude)
         # Create the text.
-        return self.prepare_content(" ".join(
+        return self.prepare_content(" ".join([
             force_str(self._resolve_field(obj, field_name))
-            for field_name in field_names
-        ))
+            for field_name in self._content_field_names
+        ]))
 
     def get_url(self, obj):
         """Return the URL of the given obj."""
@@ -165,13 +270,23 @@ class SearchAdapter(object):
     def serialize_meta(self, obj):
         """serialise meta ready to be saved in "meta_encoded"."""
         meta_obj = self.get_meta(obj)
-        return json.dumps(meta_obj, cls=DjangoJSONEncoder)
+        # Most adapters don't store any meta, so skip the encoder entirely.
+        if meta_obj == {}:
+            return "{}"
+        return encode_json(meta_obj)
 
     def deserialize_meta(self, meta_encoded):
         """
         deserialize the encoded meta string for use in views etc., this is
         used by SearchEntry's _deserialize_meta method to create the "meta" property
         """
+        # Meta written by the json module may hold NaN, which orjson can't decode, or integers beyond
+        # 64 bits, which orjson decodes as floats.
+        if _use_orjson() and not RE_JSON_LARGE_INT.search(meta_encoded):
+            try:
+                return orjson.loads(meta_encoded)
+            except orjson.JSONDecodeError:
+                pass
         return json.loads(meta_encoded)
 
     def get_live_queryset(self):
@@ -198,27 +313,67 @@ class SearchContextError(Exception):
     """Something went wrong with the search context management."""
 
 
-def _bulk_save_search_entries(search_entries, batch_size=100):
-    """Creates the given search entry data in the most efficient way possible."""
+# The search entry fields that are rewritten when an object is re-indexed.
+SEARCH_ENTRY_UPDATE_FIELDS = ("title", "description", "content", "url", "meta_encoded")
+
+
+def _md5_hexdigest(value):
+    """Returns the MD5 hex digest of the given value, matching the MD5 database function."""
+    return hashlib.md5(force_str(value).encode("utf-8")).hexdigest()
+
+
+def _bulk_save_search_entries(search_entries, batch_size=1000):
+    """
+    Creates the given search entry data in the most efficient way possible.
+
+    The search entries can be any iterable, and are consumed one batch at a time.
+    """
     from watson.models import SearchEntry
-    if search_entries:
-        search_entries = iter(search_entries)
-        while True:
-            search_entry_batch = list(islice(search_entries, 0, batch_size))
-            if not search_entry_batch:
-                break
-            SearchEntry.objects.bulk_create(search_entry_batch)
+    search_entries = iter(search_entries)
+    search_entry_batch = list(islice(search_entries, batch_size))
+    if search_entry_batch:
+        # Load the search entries using COPY on PostgreSQL, if django-bulk-load is enabled.
+        if _use_bulk_load(connections[router.db_for_write(SearchEntry)]):
+            bulk_insert = bulk_insert_models
+        else:
+            bulk_insert = SearchEntry.objects.bulk_create
+        while search_entry_batch:
+            bulk_insert(search_entry_batch)
+            search_entry_batch = list(islice(search_entries, batch_size))
+
+
+class SearchContextFrame(object):
+
+    """A single level in a search context."""
+
+    __slots__ = ("objects", "is_invalid",)
+
+    def __init__(self):
+        """Initializes the search context level."""
+        # The objects to index, keyed by engine, model and primary key.
+        self.objects = {}
+        self.is_invalid = False
 
 
 class SearchContextManager(local):
 
     """A thread-local context manager used to manage saving search data."""
 
+    def __new__(cls, *args, **kwargs):
+        """
+        Creates the search context manager.
+
+        The signal receiver is connected here rather than in __init__, which runs
+        again on first access from every thread.
+        """
+        self = super(SearchContextManager, cls).__new__(cls, *args, **kwargs)
+        # Connect to the signalling framework.
+        request_finished.connect(self._request_finished_receiver)
+        return self
+
     def __init__(self):
         """Initializes the search context."""
         self._stack = []
-        # Connect to the signalling framework.
-        request_finished.connect(self._request_finished_receiver)
 
     def is_active(self):
         """Checks that this search context is active."""
@@ -231,37 +386,41 @@ class SearchContextManager(local):
 
     def start(self):
         """Starts a level in the search context."""
-        self._stack.append((set(), False))
+        self._stack.append(SearchContextFrame())
 
     def add_to_context(self, engine, obj):
-        """Adds an object to the current context, if active."""
+        """
+        Adds an object to the current context, if active.
+
+        If the same database row is added more than once, only its latest state is indexed.
+        """
         self._assert_active()
-        objects, _ = self._stack[-1]
-        objects.add((engine, obj))
+        self._stack[-1].objects[engine, obj.__class__, obj.pk] = obj
 
     def invalidate(self):
         """Marks this search context as broken, so should not be committed."""
         self._assert_active()
-        objects, _ = self._stack[-1]
-        self._stack[-1] = (objects, True)
+        self._stack[-1].is_invalid = True
 
     def is_invalid(self):
         """Checks whether this search context is invalid."""
         self._assert_active()
-        _, is_invalid = self._stack[-1]
-        return is_invalid
+        return self._stack[-1].is_invalid
 
     def end(self):
         """Ends a level in the search context."""
         self._assert_active()
         # Save all the models.
-        tasks, is_invalid = self._stack.pop()
-        if not is_invalid:
-            _bulk_save_search_entries(
-                list(chain.from_iterable(engine._update_obj_index_iter(obj)
-                                         for engine, obj in tasks)
-                     )
-            )
+        frame = self._stack.pop()
+        if not frame.is_invalid:
+            # Group the objects by engine and model, so each group can be indexed together.
+            grouped_objs = defaultdict(list)
+            for (engine, model, _), obj in frame.objects.items():
+                grouped_objs[engine, model].append(obj)
+            _bulk_save_search_entries(chain.from_iterable(
+                engine._update_objs_index_iter(model, objs)
+                for (engine, model), objs in grouped_objs.items()
+            ))
 
     # Context management.
 
@@ -437,18 +596,19 @@ class SearchEngine(object):
 
     def get_adapter(self, model):
         """Returns the adapter associated with the given model."""
-        if self.is_registered(model):
+        try:
             return self._registered_models[model]
-        raise RegistrationError("{model!r} is not registered with this search engine".format(
-            model=model,
-        ))
+        except KeyError:
+            raise RegistrationError("{model!r} is not registered with this search engine".format(
+                model=model,
+            ))
 
     def _get_deleted_entries_for_model(self, model):
         """Returns a queryset of entries associated with deleted object instances of the given model"""
         from django.contrib.contenttypes.models import ContentType
-        from watson.models import SearchEntry, has_int_pk, get_pk_output_field
+        from watson.models import SearchEntry, get_pk_output_field
         content_type = ContentType.objects.get_for_model(model)
-        object_id_field = 'object_id_int' if has_int_pk(model) else 'object_id'
+        object_id_field = 'object_id_int' if self.get_adapter(model)._has_int_pk else 'object_id'
         return SearchEntry.objects.annotate(
             # normalize the object id into a field of the correct type for the original table
             normalized_pk=Cast(object_id_field, get_pk_output_field(model))
@@ -463,19 +623,20 @@ class SearchEngine(object):
             )
         )
 
-    def _get_entries_for_obj(self, obj):
+    def _get_entries_for_obj(self, obj, adapter=None):
         """Returns a queryset of entries associate with the given obj."""
         from django.contrib.contenttypes.models import ContentType
-        from watson.models import SearchEntry, has_int_pk, get_str_pk
+        from watson.models import SearchEntry, get_str_pk
         model = obj.__class__
+        if adapter is None:
+            adapter = self.get_adapter(model)
         content_type = ContentType.objects.get_for_model(model)
         # Get the basic list of search entries.
         search_entries = SearchEntry.objects.filter(
             content_type=content_type,
             engine_slug=self._engine_slug,
         )
-        object_id = get_str_pk(obj, connections[search_entries.db])
-        if has_int_pk(model):
+        if adapter._has_int_pk:
             # Do a fast indexed lookup.
             object_id_int = int(obj.pk)
             search_entries = search_entries.filter(
@@ -485,20 +646,13 @@ class SearchEngine(object):
             # Alas, have to do a slow unindexed lookup.
             object_id_int = None
             search_entries = search_entries.filter(
-                object_id=object_id,
+                object_id=get_str_pk(obj, connections[search_entries.db]),
             )
         return object_id_int, search_entries
 
-    def _update_obj_index_iter(self, obj):
-        """Either updates the given object index, or yields an unsaved search entry."""
-        from django.contrib.contenttypes.models import ContentType
-        from watson.models import SearchEntry, get_str_pk
-        model = obj.__class__
-        adapter = self.get_adapter(model)
-        content_type = ContentType.objects.get_for_model(model)
-        object_id = get_str_pk(obj, connections[router.db_for_write(ContentType)])
-        # Create the search entry data.
-        search_entry_data = {
+    def _get_search_entry_data(self, adapter, obj):
+        """Returns the search entry field values for the given obj."""
+        return {
             "engine_slug": self._engine_slug,
             "title": adapter.get_title(obj),
             "description": adapter.get_description(obj),
@@ -506,15 +660,24 @@ class SearchEngine(object):
             "url": adapter.get_url(obj),
             "meta_encoded": adapter.serialize_meta(obj),
         }
+
+    def _update_obj_index_iter(self, obj):
+        """Either updates the given object index, or yields an unsaved search entry."""
+        from django.contrib.contenttypes.models import ContentType
+        from watson.models import SearchEntry, get_str_pk
+        model = obj.__class__
+        adapter = self.get_adapter(model)
+        # Create the search entry data.
+        search_entry_data = self._get_search_entry_data(adapter, obj)
         # Try to get the existing search entry.
-        object_id_int, search_entries = self._get_entries_for_obj(obj)
+        object_id_int, search_entries = self._get_entries_for_obj(obj, adapter)
         # Attempt to update the search entries.
         update_count = search_entries.update(**search_entry_data)
         if update_count == 0:
             # This is the first time the entry was created.
             search_entry_data.update((
-                ("content_type", content_type),
-                ("object_id", object_id),
+                ("content_type", ContentType.objects.get_for_model(model)),
+                ("object_id", get_str_pk(obj, connections[router.db_for_write(ContentType)])),
                 ("object_id_int", object_id_int),
             ))
             yield SearchEntry(**search_entry_data)
@@ -522,6 +685,81 @@ class SearchEngine(object):
             # Oh no! Somehow we've got duplicated search entries!
             search_entries.exclude(id=search_entries[0].id).delete()
 
+    def _update_objs_index_iter(self, model, objs, force=False, batch_size=None):
+        """
+        Either updates the index for the given objs of a single model, or yields
+        unsaved search entries.
+
+        The existing search entries for all the objs are fetched in a single query. Unchanged
+        search entries are skipped, unless force is True. Changed search entries are updated
+        batch_size at a time, or as many as the database allows if batch_size is None.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from watson.models import SearchEntry, get_str_pk
+        adapter = self.get_adapter(model)
+        content_type = ContentType.objects.get_for_model(model)
+        connection = connections[router.db_for_write(ContentType)]
+        object_ids = [get_str_pk(obj, connection) for obj in objs]
+        search_entries = SearchEntry.objects.filter(
+            content_type=content_type,
+            engine_slug=self._engine_slug,
+        )
+        # Fetch all the existing search entries, keyed by the indexed object id.
+        if adapter._has_int_pk:
+            object_id_field = "object_id_int"
+            object_keys = object_id_ints = [int(obj.pk) for obj in objs]
+        else:
+            object_id_field = "object_id"
+            object_keys = object_ids
+            object_id_ints = [None] * len(objs)
+        # Fingerprints of the stored fields are fetched too, so unchanged search entries can be skipped.
+        search_entry_fields = ["id", object_id_field]
+        if not force:
+            search_entry_fields.extend(map(MD5, SEARCH_ENTRY_UPDATE_FIELDS))
+        existing_search_entries = {}
+        duplicate_search_entry_ids = []
+        for search_entry_id, object_key, *search_entry_hashes in search_entries.filter(**{
+            object_id_field + "__in": object_keys,
+        }).values_list(*search_entry_fields):
+            if object_key in existing_search_entries:
+                # Oh no! Somehow we've got duplicated search entries!
+                duplicate_search_entry_ids.append(search_entry_id)
+            else:
+                existing_search_entries[object_key] = (search_entry_id, search_entry_hashes)
+        if duplicate_search_entry_ids:
+            SearchEntry.objects.filter(id__in=duplicate_search_entry_ids).delete()
+        # Partition the search entries into updates and inserts.
+        updated_search_entries = []
+        new_search_entries = []
+        for obj, object_id, object_id_int, object_key in zip(objs, object_ids, object_id_ints, object_keys):
+            search_entry_data = self._get_search_entry_data(adapter, obj)
+            existing_search_entry = existing_search_entries.get(object_key)
+            if existing_search_entry is None:
+                # This is the first time the entry was created.
+                search_entry_data.update((
+                    ("content_type", content_type),
+                    ("object_id", object_id),
+                    ("object_id_int", object_id_int),
+                ))
+                new_search_entries.append(SearchEntry(**search_entry_data))
+                continue
+            search_entry_id, search_entry_hashes = existing_search_entry
+            # Only update the search entry if it has changed, or the update is forced.
+            if force or search_entry_hashes != [
+                _md5_hexdigest(search_entry_data[field_name])
+                for field_name in SEARCH_ENTRY_UPDATE_FIELDS
+            ]:
+                updated_search_entries.append(SearchEntry(id=search_entry_id, **search_entry_data))
+        # Update the existing search entries in bulk, and yield the new ones.
+        if updated_search_entries:
+            SearchEntry.objects.bulk_update(
+                updated_search_entries,
+                SEARCH_ENTRY_UPDATE_FIELDS,
+                batch_size=batch_size,
+            )
+        for search_entry in new_search_entries:
+            yield search_entry
+
     def cleanup_model_index(self, model):
         """Removes search index entries which map to deleted object instances for the given model"""
         search_entries = self._get_deleted_entries_for_model(model)
@@ -529,7 +767,7 @@ class SearchEngine(object):
 
     def update_obj_index(self, obj):
         """Updates the search index for the given obj."""
-        _bulk_save_search_entries(list(self._update_obj_index_iter(obj)))
+        _bulk_save_search_entries(self._update_obj_index_iter(obj))
 
     # Signalling hooks.
 
@@ -552,34 +790,41 @@ class SearchEngine(object):
         from django.contrib.contenttypes.models import ContentType
         from watson.models import has_int_pk
         filters = Q()
+        # Whole models are matched together, using a single content type lookup.
+        content_types = []
         for model in models:
-            filter = Q()
+            # Process whole models.
+            if not isinstance(model, QuerySet):
+                content_types.append(ContentType.objects.get_for_model(model))
+                continue
             # Process querysets.
-            if isinstance(model, QuerySet):
-                sub_queryset = model
-                model = model.model
-                queryset = sub_queryset.values_list("pk", flat=True)
-                if has_int_pk(model):
-                    filter &= Q(
-                        object_id_int__in=queryset,
-                    )
-                else:
-                    queryset = queryset.annotate(
-                        watson_pk_str=RawSQL(backend.do_string_cast(
-                            connections[queryset.db],
-                            model._meta.pk.db_column or model._meta.pk.attname,
-                        ), ()),
-                    ).values_list("watson_pk_str", flat=True)
-                    filter &= Q(
-                        object_id__in=queryset,
-                    )
+            sub_queryset = model
+            model = model.model
+            queryset = sub_queryset.values_list("pk", flat=True)
+            if has_int_pk(model):
+                filter = Q(
+                    object_id_int__in=queryset,
+                )
+            else:
+                queryset = queryset.annotate(
+                    watson_pk_str=RawSQL(backend.do_string_cast(
+                        connections[queryset.db],
+                        model._meta.pk.db_column or model._meta.pk.attname,
+                    ), ()),
+                ).values_list("watson_pk_str", flat=True)
+                filter = Q(
+                    object_id__in=queryset,
+                )
             # Add the model to the filter.
-            content_type = ContentType.objects.get_for_model(model)
             filter &= Q(
-                content_type=content_type,
+                content_type=ContentType.objects.get_for_model(model),
             )
             # Combine with the other filters.
             filters |= filter
+        if content_types:
+            filters |= Q(
+                content_type__in=content_types,
+            )
         return filters
 
     def _get_included_models(self, models):
@@ -599,11 +844,11 @@ class SearchEngine(object):
     def search(self, search_text, models=(), exclude=(), ranking=True, backend_name=None):
         """Performs a search using the given text, returning a queryset of SearchEntry."""
         from watson.models import SearchEntry
-        backend = get_backend(backend_name=backend_name)
         # Check for blank search text.
         search_text = search_text.strip()
         if not search_text:
             return SearchEntry.objects.none()
+        backend = get_backend(backend_name=backend_name)
         # Get the initial queryset.
         queryset = SearchEntry.objects.filter(
             engine_slug=self._engine_slug,
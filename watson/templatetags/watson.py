@@ -3,15 +3,34 @@
 from __future__ import unicode_literals
 
 from django import template
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import prefetch_related_objects
+from django.core.signals import setting_changed
 
 
 register = template.Library()
 
 
+# The templates selected by search_result_item, keyed by content type. Not used when DEBUG is on,
+# so that template changes show up without a restart.
+_search_result_item_templates = {}
+
+
+def _clear_search_result_item_templates(**kwargs):
+    """Clears the selected templates, whenever the available templates may have changed."""
+    _search_result_item_templates.clear()
+
+
+setting_changed.connect(_clear_search_result_item_templates)
+
+
 @register.simple_tag(takes_context=True)
 def search_results(context, search_results):
     """Renders a list of search results."""
+    # Fetch the objects for all the search results in bulk, rather than once per result.
+    search_results = list(search_results)
+    prefetch_related_objects(search_results, "object")
     # Render the template.
     context.push()
     try:
@@ -28,11 +47,21 @@ def search_results(context, search_results):
 def search_result_item(context, search_result):
     obj = search_result.object
     content_type = ContentType.objects.get_for_id(search_result.content_type_id)
-
-    params = {
-        "app_label": content_type.app_label,
-        "model_name": content_type.model,
-    }
+    # Select the template, once per content type.
+    template_key = (content_type.app_label, content_type.model)
+    item_template = None if settings.DEBUG else _search_result_item_templates.get(template_key)
+    if item_template is None:
+        params = {
+            "app_label": content_type.app_label,
+            "model_name": content_type.model,
+        }
+        item_template = template.loader.select_template((
+            "watson/includes/search_result_{app_label}_{model_name}.html".format(**params),
+            "watson/includes/search_result_{app_label}.html".format(**params),
+            "watson/includes/search_result_item.html",
+        ))
+        if not settings.DEBUG:
+            _search_result_item_templates[template_key] = item_template
     # Render the template.
     context.push()
     try:
@@ -41,10 +70,6 @@ def search_result_item(context, search_result):
             "result": search_result,
             "query": context["query"],
         })
-        return template.loader.render_to_string((
-            "watson/includes/search_result_{app_label}_{model_name}.html".format(**params),
-            "watson/includes/search_result_{app_label}.html".format(**params),
-            "watson/includes/search_result_item.html",
-        ), context.flatten())
+        return item_template.render(context.flatten())
     finally:
         context.pop()
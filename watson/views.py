@@ -2,8 +2,6 @@
 
 from __future__ import unicode_literals
 
-import json
-
 from django.shortcuts import redirect
 from django.http import HttpResponse
 from django.views import generic
@@ -87,26 +85,37 @@ class SearchView(SearchMixin, generic.ListView):
 
     template_name = "watson/search_results.html"
 
+    def get_queryset(self):
+        """Returns the initial queryset, fetching the objects for the search results in bulk."""
+        return super(SearchView, self).get_queryset().prefetch_related("object")
+
 
 class SearchApiView(SearchMixin, BaseListView):
 
     """A JSON-based search API."""
 
+    def get_queryset(self):
+        """Returns the initial queryset, without the fields that aren't rendered."""
+        return super(SearchApiView, self).get_queryset().only(
+            "engine_slug", "content_type", "title", "description", "url", "meta_encoded",
+        )
+
     def render_to_response(self, context, **response_kwargs):
         """Renders the search results to the response."""
-        content = json.dumps({
+        data = {
             "results": [
                 {
                     "title": result.title,
                     "description": result.description,
                     "url": result.url,
                     "meta": result.meta,
-                } for result in context[self.get_context_object_name(self.get_queryset())]
+                } for result in context["object_list"]
             ]
-        }).encode("utf-8")
+        }
+        content = watson.encode_json(data).encode("utf-8")
         # Generate the response.
+        response_kwargs["content_type"] = "application/json; charset=utf-8"
         response = HttpResponse(content, **response_kwargs)
-        response["Content-Type"] = "application/json; charset=utf-8"
         response["Content-Length"] = len(content)
         return response
 